@@ -19,29 +19,48 @@ Activity & event types:
 
 import argparse
 import csv
-import json
+import io
 import logging
 import pickle
 import re
+import shutil
 import string
 import sys
+import threading
 import unicodedata
 import zipfile
-from datetime import datetime, timedelta, tzinfo
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
 from getpass import getpass
 from math import floor
-from os import stat, utime
+from os import replace, scandir, stat, utime
 from os.path import dirname, join, realpath
 from pathlib import Path
-from typing import Dict, Union
+from pprint import pformat
+from types import SimpleNamespace
+from typing import AbstractSet, Dict, Union
 
 import requests
-from pprintpp import pprint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 
 from shared_logging import setup_logging
 from utilities import load_yaml, load_properties, get_valid_filename
 
+try:
+    # optional: orjson parses much faster than the json module and takes the raw response bytes
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    import json
+    from json import loads as json_loads
+
+    def json_dumps(obj):
+        """Serialize obj to UTF-8 encoded JSON bytes, like orjson.dumps"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+logger = logging.getLogger(__name__)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("requests").setLevel(logging.WARNING)
 
@@ -53,6 +72,12 @@ ALMOST_RFC_1123 = "%a, %d %b %Y %H:%M"
 
 # used by sanitize_filename()
 VALID_FILENAME_CHARS = "-_.() %s%s" % (string.ascii_letters, string.digits)
+# drops every ASCII character not in VALID_FILENAME_CHARS and turns spaces into underscores
+FILENAME_TRANSLATION = str.maketrans({chr(c): None for c in range(128) if chr(c) not in VALID_FILENAME_CHARS})
+FILENAME_TRANSLATION[ord(' ')] = '_'
+# the same filtering for the ASCII bytes of a normalized non-ASCII name
+FILENAME_BYTES_TRANSLATION = bytes.maketrans(b' ', b'_')
+FILENAME_BYTES_DELETE = bytes(c for c in range(256) if chr(c) not in VALID_FILENAME_CHARS)
 
 # map the numeric parentTypeId to its name for the CSV output
 PARENT_TYPE_ID = {
@@ -70,8 +95,14 @@ PARENT_TYPE_ID = {
     149: 'yoga'
 }
 
+# number formatters used for the CSV output (bound once instead of parsing the format spec per call)
+FORMAT_0F = "{:.0f}".format
+FORMAT_2F = "{:.2f}".format
+FORMAT_3F = "{:.3f}".format
+FORMAT_5F = "{:.5f}".format
+
 # typeId values using pace instead of speed
-USES_PACE = {1, 3, 9}  # running, hiking, walking
+USES_PACE = frozenset([1, 3, 9])  # running, hiking, walking
 
 # Maximum number of activities you can request at once.
 # Used to be 100 and enforced by Garmin for older endpoints; for the current endpoint 'LIST'
@@ -80,6 +111,40 @@ LIMIT_MAXIMUM = 1000
 
 MAX_TRIES = 3
 
+# age after which the cached activity/event type properties are fetched again
+PROPERTIES_MAX_AGE = timedelta(days=7)
+
+# tries to get activity details with a summaryDTO; HTTP errors are already retried by the session
+DETAILS_TRIES = 2
+
+# marks a key missing from the device cache (where None is a valid value)
+_MISSING = object()
+
+# activity file formats download_activity can write
+DOWNLOAD_FORMATS = frozenset(["ORIGINAL", "GPX", "JSON"])
+
+# minimum number of keep-alive connections kept open to each Garmin host
+HTTP_POOL_SIZE = 32
+
+# (connect, read) timeouts in seconds for the JSON API calls
+HTTP_TIMEOUT = (5, 30)
+# (connect, read) timeouts in seconds for the activity file downloads
+DOWNLOAD_TIMEOUT = (5, 60)
+
+# top-level keys of the activity details read by csv_write_record and extract_device;
+# the other keys can be large (e.g. splits) and are dropped while a chunk is processed
+DETAIL_KEYS = frozenset(['activityId', 'summaryDTO', 'metadataDTO', 'timeZoneUnitDTO', 'accessControlRuleDTO',
+                         'locationName'])
+
+# number of activities processed (details, device, gear and download) concurrently
+MAX_WORKERS = 8
+
+# buffer size for the CSV output and the downloaded activity files
+WRITE_BUFFER_SIZE = 1 << 20
+
+# number of CSV records collected in memory before they are written to the CSV file
+CSV_FLUSH_ROWS = 512
+
 CSV_TEMPLATE = join(dirname(realpath(__file__)), "csv_header_default.yaml")
 
 WEBHOST = "https://connect.garmin.com"
@@ -118,6 +183,9 @@ LOGIN_PARAMS = {
     'showPassword': 'true'
 }
 
+# service ticket in the login response, searched in the raw bytes of the body
+TICKET_RE = re.compile(rb'\?ticket=([-\w]+)";')
+
 
 def resolve_path(directory, subdir, time):
     """
@@ -128,18 +196,22 @@ def resolve_path(directory, subdir, time):
     :return: Updated dictionary string
     """
     ret = join(directory, subdir)
-    if re.compile(".*{YYYY}.*").match(ret):
-        ret = ret.replace("{YYYY}", time[0:4])
-    if re.compile(".*{MM}.*").match(ret):
-        ret = ret.replace("{MM}", time[5:7])
+    # str.replace is a no-op when the place holder is absent
+    return ret.replace("{YYYY}", time[0:4]).replace("{MM}", time[5:7])
 
-    return ret
+
+def extract_login_ticket(content):
+    """Return the service ticket from the raw bytes of the login response, None if there is none"""
+    match = TICKET_RE.search(content)
+    return match.group(1).decode('ascii') if match else None
 
 
 def hhmmss_from_seconds(sec):
     """Helper function that converts seconds to HH:MM:SS time format."""
     if isinstance(sec, (float, int)):
-        formatted_time = str(timedelta(seconds=int(sec))).zfill(8)
+        hours, remainder = divmod(int(sec), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
     else:
         formatted_time = "0.000"
     return formatted_time
@@ -155,40 +227,71 @@ def sanitize_filename(name, max_length=0):
     Remove or replace characters that are unsafe for filename
     """
     # inspired by https://stackoverflow.com/a/698714/3686
-    cleaned_filename = unicodedata.normalize('NFKD', name).encode('ASCII', 'ignore') if name else ''
-    stripped_filename = ''.join(c for c in cleaned_filename if c in VALID_FILENAME_CHARS).replace(' ', '_')
+    if not name:
+        return ''
+    if name.isascii():
+        stripped_filename = name.translate(FILENAME_TRANSLATION)
+    else:
+        # decompose accented characters so that the ASCII base character survives the encoding
+        cleaned_filename = unicodedata.normalize('NFKD', name).encode('ASCII', 'ignore')
+        stripped_filename = cleaned_filename.translate(FILENAME_BYTES_TRANSLATION,
+                                                       FILENAME_BYTES_DELETE).decode('ASCII')
     return stripped_filename[:max_length] if max_length > 0 else stripped_filename
 
 
 def write_to_file(filename, content, mode, file_time=None):
     """Helper function that persists content to file."""
-    with open(filename, mode) as f:
+    with open(filename, mode, buffering=WRITE_BUFFER_SIZE) as f:
         f.write(content)
     if file_time:
         utime(filename, (file_time, file_time))
 
 
-def absent_or_null(element, act):
-    """Return False only if act[element] is valid and not None"""
-    if not act:
-        return True
-    elif element not in act:
-        return True
-    elif act[element]:
-        return False
-    return True
+def stream_to_file(filename, response, file_time=None):
+    """
+    Helper function that persists the body of a streamed HTTP response (stream=True) to file,
+    copying it in large blocks instead of holding the whole body in memory; returns the number of bytes written
+    """
+    # let urllib3 undo a gzip/deflate Content-Encoding while reading
+    response.raw.decode_content = True
+    with open(filename, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        shutil.copyfileobj(response.raw, f, WRITE_BUFFER_SIZE)
+        file_size = f.tell()
+    if file_time:
+        utime(filename, (file_time, file_time))
+    return file_size
+
+
+def value_if_found_else_key(some_dict, key):
+    """Lookup a value in some_dict and use the key itself as fallback"""
+    return some_dict.get(key, key)
+
+
+def activity_type_labels(activity_type_name):
+    """
+    Build a map from the activity typeKey to its name, using the 'activity_type_<typeKey>' entries
+    of the activity type properties, so that the CSV records need only a single lookup per activity
+    """
+    prefix = 'activity_type_'
+    return {key[len(prefix):]: value for key, value in activity_type_name.items() if key.startswith(prefix)}
+
 
+def from_activities_or_detail(element, act, detail_container):
+    """
+    Return detail_container[element] if valid and act[element] (or None) otherwise;
+    detail_container is a part of the activity details, e.g. its summaryDTO
+    """
+    return detail_container.get(element) or act.get(element) or None
 
-def from_activities_or_detail(element, act, detail, detail_container):
-    """Return detail[detail_container][element] if valid and act[element] (or None) otherwise"""
-    if absent_or_null(detail_container, detail) or absent_or_null(element, detail[detail_container]):
-        return None if absent_or_null(element, act) else act[element]
-    return detail[detail_container][element]
+
+def required_details(details):
+    """Return only the part of the activity details listed in DETAIL_KEYS"""
+    return {key: details[key] for key in DETAIL_KEYS if key in details}
 
 
 def trunc6(some_float):
     """Return the given float as string formatted with six digit precision"""
-    return "{0:12.6f}".format(floor(some_float * 1000000) / 1000000).lstrip()
+    return f"{floor(some_float * 1000000) / 1000000:.6f}"
 
 
 # A class building tzinfo objects for fixed-offset time zones.
@@ -214,36 +317,93 @@ class FixedOffset(tzinfo):
         return timedelta(0)
 
 
+def parse_naive_date_time(timestamp):
+    """
+    Parse a timestamp in the fixed format "%Y-%m-%d %H:%M:%S" (as used in the activitylist-service.json)
+    into a 'naive' datetime; slicing is much faster than datetime.strptime for a fixed format
+    """
+    return datetime(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                    int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]))
+
+
+@lru_cache(maxsize=None)
+def local_offset(minutes):
+    """
+    Return the (shared) tzinfo object for an offset in minutes east from UTC;
+    datetime.timezone is implemented in C, unlike FixedOffset
+    """
+    return timezone(timedelta(minutes=minutes), "LCL")
+
+
 def offset_date_time(time_local, time_gmt):
     """
     Build an 'aware' datetime from two 'naive' datetime objects (that is timestamps
     as present in the activitylist-service.json), using the time difference as offset.
     """
-    local_dt = datetime.strptime(time_local, "%Y-%m-%d %H:%M:%S")
-    gmt_dt = datetime.strptime(time_gmt, "%Y-%m-%d %H:%M:%S")
+    local_dt = parse_naive_date_time(time_local)
+    gmt_dt = parse_naive_date_time(time_gmt)
     offset = local_dt - gmt_dt
-    offset_tz = FixedOffset(offset.seconds / 60, "LCL")
-    return local_dt.replace(tzinfo=offset_tz)
+    # total_seconds() keeps the sign of offsets west of UTC (timedelta.seconds is never negative)
+    return local_dt.replace(tzinfo=local_offset(int(offset.total_seconds() // 60)))
 
 
-def pace_or_speed_raw(type_id, parent_type_id, mps):
-    """Convert speed (m/s) to speed (km/h) or pace (min/km) depending on type and parent type"""
-    kmh = 3.6 * mps
-    if (type_id in USES_PACE) or (parent_type_id in USES_PACE):
-        return 60 / kmh
-    return kmh
+def uses_pace(type_id, parent_type_id):
+    """Return True if speeds of this type and parent type are shown as pace (min/km) instead of km/h"""
+    return type_id in USES_PACE or parent_type_id in USES_PACE
 
 
-def pace_or_speed_formatted(type_id, parent_type_id, mps):
+def pace_or_speed_strings(is_pace, mps):
     """
-    Convert speed (m/s) to string: speed (km/h as x.x) or
-    pace (min/km as MM:SS), depending on type and parent type
+    Convert speed (m/s) to the tuple of strings (speed in km/h or pace in min/km truncated by trunc6,
+    speed as x.x or pace as MM:SS), depending on is_pace, the result of uses_pace
     """
     kmh = 3.6 * mps
-    if (type_id in USES_PACE) or (parent_type_id in USES_PACE):
-        # format seconds per kilometer as MM:SS, see https://stackoverflow.com/a/27751293
-        return '{0:02d}:{1:02d}'.format(*divmod(int(round(3600 / kmh)), 60))
-    return "{0:.1f}".format(round(kmh, 1))
+    if is_pace:
+        seconds = round(3600 / kmh)
+        return trunc6(60 / kmh), f"{seconds // 60:02d}:{seconds % 60:02d}"
+    return trunc6(kmh), f"{kmh:.1f}"
+
+
+# columns holding a single value of the activity or its summaryDTO, as (column, source, key, formatter);
+# CsvFilter.set_simple_columns sets the ones in its template, a missing or zero value leaves the column empty
+SIMPLE_COLUMNS = (
+    ('durationRaw', 'activity', 'duration', FORMAT_3F),
+    ('movingDurationRaw', 'summary', 'movingDuration', FORMAT_3F),
+    ('averageSpeedRaw', 'summary', 'averageSpeed', kmh_from_mps),
+    ('averageMovingSpeedRaw', 'summary', 'averageMovingSpeed', kmh_from_mps),
+    ('maxSpeedRaw', 'summary', 'maxSpeed', kmh_from_mps),
+    ('maxHRRaw', 'summary', 'maxHR', str),
+    ('maxHR', 'activity', 'maxHR', FORMAT_0F),
+    ('averageHRRaw', 'summary', 'averageHR', str),
+    ('averageHR', 'activity', 'averageHR', FORMAT_0F),
+    ('caloriesRaw', 'summary', 'calories', str),
+    ('calories', 'summary', 'calories', FORMAT_0F),
+    ('vo2max', 'activity', 'vO2MaxValue', str),
+    ('aerobicEffect', 'summary', 'trainingEffect', FORMAT_2F),
+    ('anaerobicEffect', 'summary', 'anaerobicTrainingEffect', FORMAT_2F),
+    ('averageRunCadence', 'summary', 'averageRunCadence', FORMAT_2F),
+    ('maxRunCadence', 'summary', 'maxRunCadence', str),
+    ('strideLength', 'summary', 'strideLength', FORMAT_2F),
+    ('steps', 'activity', 'steps', str),
+    ('averageCadence', 'activity', 'averageBikingCadenceInRevPerMinute', str),
+    ('maxCadence', 'activity', 'maxBikingCadenceInRevPerMinute', str),
+    ('strokes', 'activity', 'strokes', str),
+    ('averageTemperature', 'summary', 'averageTemperature', str),
+    ('minTemperature', 'summary', 'minTemperature', str),
+    ('maxTemperature', 'summary', 'maxTemperature', str),
+)
+
+
+@lru_cache(maxsize=8)
+def load_csv_template(csv_header_properties, mtime):
+    """
+    Read a CSV column template, returning the tuple of column names (in output order)
+    and the dict mapping the column names to their headers. The result is cached per
+    path and modification time (mtime), so it must not be modified by the caller.
+    """
+    del mtime  # only part of the cache key
+    csv_headers = load_yaml(csv_header_properties)
+    return tuple(csv_headers), csv_headers
 
 
 class CsvFilter(object):
@@ -251,37 +411,97 @@ class CsvFilter(object):
 
     def __init__(self, csv_file, csv_header_properties):
         self.__csv_file = csv_file
-        with open(csv_header_properties, 'r') as prop:
-            csv_header_props = prop.read()
-        self.__csv_columns = []
-        self.__csv_headers = load_properties(csv_header_props, keys=self.__csv_columns)
-        self.__csv_field_names = []
-        for column in self.__csv_columns:
-            self.__csv_field_names.append(self.__csv_headers[column])
-        self.__writer = csv.DictWriter(self.__csv_file, fieldnames=self.__csv_field_names, quoting=csv.QUOTE_ALL)
-        self.__current_row = {}
+        # the template maps each column name to its header, in output order
+        self.__csv_columns, self.__csv_headers = load_csv_template(csv_header_properties,
+                                                                   stat(csv_header_properties).st_mtime)
+        # position of each active column in the CSV record
+        self.__csv_column_index = {column: index for index, column in enumerate(self.__csv_columns)}
+        # records are collected in a string buffer and written to the CSV file in chunks
+        self.__buffer = io.StringIO()
+        self.__buffered_rows = 0
+        self.__writer = csv.writer(self.__buffer, quoting=csv.QUOTE_ALL)
+        self.__current_row = [''] * len(self.__csv_columns)
+        # the SIMPLE_COLUMNS of this template, with the position of the column instead of its name
+        self.__simple_columns = tuple((self.__csv_column_index[column], source, key, formatter)
+                                      for column, source, key, formatter in SIMPLE_COLUMNS
+                                      if column in self.__csv_column_index)
 
     def write_header(self):
         """Write the active column names as CSV header"""
-        self.__writer.writeheader()
+        self.__writer.writerow([self.__csv_headers[column] for column in self.__csv_columns])
 
     def write_row(self):
         """Write the prepared CSV record"""
         self.__writer.writerow(self.__current_row)
-        self.__current_row = {}
+        self.__current_row = [''] * len(self.__csv_columns)
+        self.__buffered_rows += 1
+        if self.__buffered_rows >= CSV_FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the collected CSV records to the CSV file and flush it;
+        must be called at the end of the export
+        """
+        self.__csv_file.write(self.__buffer.getvalue())
+        self.__csv_file.flush()
+        self.__buffer.seek(0)
+        self.__buffer.truncate(0)
+        self.__buffered_rows = 0
 
     def set_column(self, name, value):
         """
         Store a column value (if the column is active) into
         the record prepared for the next write_row call
         """
-        if value and name in self.__csv_columns:
-            # must encode in UTF-8 because the Python 'csv' module doesn't support unicode
-            self.__current_row[self.__csv_headers[name]] = value.encode('utf8')
+        index = self.__csv_column_index.get(name)
+        if value and index is not None:
+            self.__current_row[index] = value
+
+    def set_simple_columns(self, activity, summary):
+        """
+        Store the values of the SIMPLE_COLUMNS of the template into the record prepared
+        for the next write_row call; activity is the activity, summary its summaryDTO
+        """
+        row = self.__current_row
+        sources = {'activity': activity, 'summary': summary}
+        for index, source, key, formatter in self.__simple_columns:
+            if value := sources[source].get(key):
+                row[index] = formatter(value)
+
+    def read_column(self, csv_filename, name):
+        """
+        Return the set of values of the column *name* in an existing CSV file with the header of this
+        template; an empty set if the file does not exist (yet), None if it has no such column
+        """
+        try:
+            with open(csv_filename, newline='', encoding='utf-8') as csv_file:
+                reader = csv.reader(csv_file)
+                header = next(reader, None)
+                if header is None:
+                    return set()
+                try:
+                    index = header.index(self.__csv_headers.get(name))
+                except ValueError:
+                    return None
+                return {row[index] for row in reader if len(row) > index}
+        except FileNotFoundError:
+            return set()
 
     def is_column_active(self, name):
         """Return True if the column is present in the header template"""
-        return name in self.__csv_columns
+        return name in self.__csv_column_index
+
+
+def positive_int(value: str) -> int:
+    """argparse type for options that need a number of at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
 
 
 def parse_arguments() -> Dict:
@@ -325,202 +545,136 @@ def parse_arguments() -> Dict:
                         help='template file with desired columns for CSV output')
     parser.add_argument('-fp', '--fileprefix', action='count',
                         help="set the local time as activity file name prefix")
+    parser.add_argument('-w', '--workers', type=positive_int, default=MAX_WORKERS,
+                        help=f'number of activities downloaded concurrently (default: {MAX_WORKERS})')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print a line per exported activity, only log it')
 
     parsed_args = vars(parser.parse_args())
     return parsed_args
 
 
-def csv_write_record(csv_filter, extract, actvty, details, activity_type_name, event_type_name):
+def csv_write_record(csv_filter, extract, actvty, details, activity_type_label, event_type_name):
     """
-    Write out the given data as a CSV record
+    Write out the given data as a CSV record; activity_type_label is the map
+    built by activity_type_labels(), event_type_name the event type properties
     """
-
-    type_id = 4 if absent_or_null('activityType', actvty) else actvty['activityType']['typeId']
-    parent_type_id = 4 if absent_or_null('activityType', actvty) else actvty['activityType']['parentTypeId']
-    if present(parent_type_id, PARENT_TYPE_ID):
+    set_column = csv_filter.set_column
+    # look up the nested containers only once
+    summary = details.get('summaryDTO') or {}
+    metadata = details.get('metadataDTO') or {}
+    time_zone = details.get('timeZoneUnitDTO') or {}
+    access_control = details.get('accessControlRuleDTO') or {}
+    activity_type = actvty.get('activityType') or {}
+    event_type = actvty.get('eventType') or {}
+    samples = extract['samples'] or {}
+
+    type_id = activity_type['typeId'] if activity_type else 4
+    parent_type_id = activity_type['parentTypeId'] if activity_type else 4
+    if parent_type_id in PARENT_TYPE_ID:
         parent_type_key = PARENT_TYPE_ID[parent_type_id]
     else:
         parent_type_key = None
         logging.warning("Unknown parentType %s, please tell script author", str(parent_type_id))
 
     # get some values from detail if present, from a otherwise
-    start_latitude = from_activities_or_detail('startLatitude', actvty, details, 'summaryDTO')
-    start_longitude = from_activities_or_detail('startLongitude', actvty, details, 'summaryDTO')
-    end_latitude = from_activities_or_detail('endLatitude', actvty, details, 'summaryDTO')
-    end_longitude = from_activities_or_detail('endLongitude', actvty, details, 'summaryDTO')
-
-    csv_filter.set_column('id', str(actvty['activityId']))
-    csv_filter.set_column('url', 'https://connect.garmin.com/modern/activity/' + str(actvty['activityId']))
-    csv_filter.set_column('activityName', actvty['activityName'] if present('activityName', actvty) else None)
-    csv_filter.set_column('description', actvty['description'] if present('description', actvty) else None)
-    csv_filter.set_column('startTimeIso', extract['start_time_with_offset'].isoformat())
-    csv_filter.set_column('startTime1123', extract['start_time_with_offset'].strftime(ALMOST_RFC_1123))
-    csv_filter.set_column('startTimeMillis',
-                          str(actvty['beginTimestamp']) if present('beginTimestamp', actvty) else None)
-    csv_filter.set_column('startTimeRaw', details['summaryDTO']['startTimeLocal'] if present('startTimeLocal', details[
-        'summaryDTO']) else None)
-    csv_filter.set_column('endTimeIso',
-                          extract['end_time_with_offset'].isoformat() if extract['end_time_with_offset'] else None)
-    csv_filter.set_column('endTime1123', extract['end_time_with_offset'].strftime(ALMOST_RFC_1123) if extract[
-        'end_time_with_offset'] else None)
-    csv_filter.set_column('endTimeMillis',
-                          str(actvty['beginTimestamp'] + extract['elapsed_seconds'] * 1000) if present('beginTimestamp',
-                                                                                                       actvty) else None)
-    csv_filter.set_column('durationRaw', str(round(actvty['duration'], 3)) if present('duration', actvty) else None)
-    csv_filter.set_column('duration',
-                          hhmmss_from_seconds(round(actvty['duration'])) if present('duration', actvty) else None)
-    csv_filter.set_column('elapsedDurationRaw',
-                          str(round(extract['elapsed_duration'], 3)) if extract['elapsed_duration'] else None)
-    csv_filter.set_column('elapsedDuration', hhmmss_from_seconds(round(extract['elapsed_duration'])) if extract[
-        'elapsed_duration'] else None)
-    csv_filter.set_column('movingDurationRaw',
-                          str(round(details['summaryDTO']['movingDuration'], 3)) if present('movingDuration', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('movingDuration',
-                          hhmmss_from_seconds(round(details['summaryDTO']['movingDuration'])) if present(
-                              'movingDuration', details['summaryDTO']) else None)
-    csv_filter.set_column('distanceRaw',
-                          "{0:.5f}".format(actvty['distance'] / 1000) if present('distance', actvty) else None)
-    csv_filter.set_column('averageSpeedRaw',
-                          kmh_from_mps(details['summaryDTO']['averageSpeed']) if present('averageSpeed', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('averageSpeedPaceRaw',
-                          trunc6(pace_or_speed_raw(type_id, parent_type_id, actvty['averageSpeed'])) if present(
-                              'averageSpeed', actvty) else None)
-    csv_filter.set_column('averageSpeedPace',
-                          pace_or_speed_formatted(type_id, parent_type_id, actvty['averageSpeed']) if present(
-                              'averageSpeed', actvty) else None)
-    csv_filter.set_column('averageMovingSpeedRaw',
-                          kmh_from_mps(details['summaryDTO']['averageMovingSpeed']) if present('averageMovingSpeed',
-                                                                                               details[
-                                                                                                   'summaryDTO']) else None)
-    csv_filter.set_column('averageMovingSpeedPaceRaw', trunc6(
-        pace_or_speed_raw(type_id, parent_type_id, details['summaryDTO']['averageMovingSpeed'])) if present(
-        'averageMovingSpeed', details['summaryDTO']) else None)
-    csv_filter.set_column('averageMovingSpeedPace', pace_or_speed_formatted(type_id, parent_type_id,
-                                                                            details['summaryDTO'][
-                                                                                'averageMovingSpeed']) if present(
-        'averageMovingSpeed', details['summaryDTO']) else None)
-    csv_filter.set_column('maxSpeedRaw', kmh_from_mps(details['summaryDTO']['maxSpeed']) if present('maxSpeed', details[
-        'summaryDTO']) else None)
-    csv_filter.set_column('maxSpeedPaceRaw', trunc6(
-        pace_or_speed_raw(type_id, parent_type_id, details['summaryDTO']['maxSpeed'])) if present('maxSpeed', details[
-        'summaryDTO']) else None)
-    csv_filter.set_column('maxSpeedPace', pace_or_speed_formatted(type_id, parent_type_id,
-                                                                  details['summaryDTO']['maxSpeed']) if present(
-        'maxSpeed', details['summaryDTO']) else None)
-    csv_filter.set_column('elevationLoss',
-                          str(round(details['summaryDTO']['elevationLoss'], 2)) if present('elevationLoss', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('elevationLossUncorr', str(round(details['summaryDTO']['elevationLoss'], 2)) if not actvty[
-        'elevationCorrected'] and present('elevationLoss', details['summaryDTO']) else None)
-    csv_filter.set_column('elevationLossCorr', str(round(details['summaryDTO']['elevationLoss'], 2)) if actvty[
-                                                                                                            'elevationCorrected'] and present(
-        'elevationLoss', details['summaryDTO']) else None)
-    csv_filter.set_column('elevationGain',
-                          str(round(details['summaryDTO']['elevationGain'], 2)) if present('elevationGain', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('elevationGainUncorr', str(round(details['summaryDTO']['elevationGain'], 2)) if not actvty[
-        'elevationCorrected'] and present('elevationGain', details['summaryDTO']) else None)
-    csv_filter.set_column('elevationGainCorr', str(round(details['summaryDTO']['elevationGain'], 2)) if actvty[
-                                                                                                            'elevationCorrected'] and present(
-        'elevationGain', details['summaryDTO']) else None)
-    csv_filter.set_column('minElevation',
-                          str(round(details['summaryDTO']['minElevation'], 2)) if present('minElevation', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('minElevationUncorr', str(round(details['summaryDTO']['minElevation'], 2)) if not actvty[
-        'elevationCorrected'] and present('minElevation', details['summaryDTO']) else None)
-    csv_filter.set_column('minElevationCorr', str(round(details['summaryDTO']['minElevation'], 2)) if actvty[
-                                                                                                          'elevationCorrected'] and present(
-        'minElevation', details['summaryDTO']) else None)
-    csv_filter.set_column('maxElevation',
-                          str(round(details['summaryDTO']['maxElevation'], 2)) if present('maxElevation', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('maxElevationUncorr', str(round(details['summaryDTO']['maxElevation'], 2)) if not actvty[
-        'elevationCorrected'] and present('maxElevation', details['summaryDTO']) else None)
-    csv_filter.set_column('maxElevationCorr', str(round(details['summaryDTO']['maxElevation'], 2)) if actvty[
-                                                                                                          'elevationCorrected'] and present(
-        'maxElevation', details['summaryDTO']) else None)
-    csv_filter.set_column('elevationCorrected', 'true' if actvty['elevationCorrected'] else 'false')
+    start_latitude = from_activities_or_detail('startLatitude', actvty, summary)
+    start_longitude = from_activities_or_detail('startLongitude', actvty, summary)
+    end_latitude = from_activities_or_detail('endLatitude', actvty, summary)
+    end_longitude = from_activities_or_detail('endLongitude', actvty, summary)
+
+    activity_id = str(actvty['activityId'])
+    start_time = extract['start_time_with_offset']
+    start_time_iso = start_time.isoformat()
+    end_time = extract['end_time_with_offset']
+    begin_timestamp = actvty.get('beginTimestamp')
+    duration = actvty.get('duration')
+    elapsed_duration = extract['elapsed_duration']
+    moving_duration = summary.get('movingDuration')
+    distance = actvty.get('distance')
+    type_key = activity_type.get('typeKey')
+    event_type_key = event_type.get('typeKey')
+
+    no_pace = (None, None)
+    is_pace = uses_pace(type_id, parent_type_id)
+    average_speed = actvty.get('averageSpeed')
+    average_moving_speed = summary.get('averageMovingSpeed')
+    max_speed = summary.get('maxSpeed')
+    average_speed_pace = pace_or_speed_strings(is_pace, average_speed) if average_speed else no_pace
+    average_moving_speed_pace = pace_or_speed_strings(is_pace, average_moving_speed) if average_moving_speed \
+        else no_pace
+    max_speed_pace = pace_or_speed_strings(is_pace, max_speed) if max_speed else no_pace
+
+    elevation_corrected = actvty.get('elevationCorrected')
+    # the elevations with two decimals, None if missing
+    elevation_loss, elevation_gain, min_elevation, max_elevation = (
+        FORMAT_2F(elevation) if elevation else None
+        for elevation in (summary.get('elevationLoss'), summary.get('elevationGain'),
+                          summary.get('minElevation'), summary.get('maxElevation')))
+
+    set_column('id', activity_id)
+    set_column('url', f'https://connect.garmin.com/modern/activity/{activity_id}')
+    set_column('activityName', actvty.get('activityName'))
+    set_column('description', actvty.get('description'))
+    set_column('startTimeIso', start_time_iso)
+    set_column('startTime1123', start_time.strftime(ALMOST_RFC_1123))
+    set_column('startTimeMillis', str(begin_timestamp) if begin_timestamp else None)
+    set_column('startTimeRaw', summary.get('startTimeLocal'))
+    set_column('endTimeIso', end_time.isoformat() if end_time else None)
+    set_column('endTime1123', end_time.strftime(ALMOST_RFC_1123) if end_time else None)
+    set_column('endTimeMillis', str(begin_timestamp + extract['elapsed_seconds'] * 1000) if begin_timestamp else None)
+    set_column('duration', hhmmss_from_seconds(round(duration)) if duration else None)
+    set_column('elapsedDurationRaw', FORMAT_3F(elapsed_duration) if elapsed_duration else None)
+    set_column('elapsedDuration', hhmmss_from_seconds(round(elapsed_duration)) if elapsed_duration else None)
+    set_column('movingDuration', hhmmss_from_seconds(round(moving_duration)) if moving_duration else None)
+    set_column('distanceRaw', FORMAT_5F(distance / 1000) if distance else None)
+    set_column('averageSpeedPaceRaw', average_speed_pace[0])
+    set_column('averageSpeedPace', average_speed_pace[1])
+    set_column('averageMovingSpeedPaceRaw', average_moving_speed_pace[0])
+    set_column('averageMovingSpeedPace', average_moving_speed_pace[1])
+    set_column('maxSpeedPaceRaw', max_speed_pace[0])
+    set_column('maxSpeedPace', max_speed_pace[1])
+    set_column('elevationLoss', elevation_loss)
+    set_column('elevationLossUncorr', elevation_loss if not elevation_corrected else None)
+    set_column('elevationLossCorr', elevation_loss if elevation_corrected else None)
+    set_column('elevationGain', elevation_gain)
+    set_column('elevationGainUncorr', elevation_gain if not elevation_corrected else None)
+    set_column('elevationGainCorr', elevation_gain if elevation_corrected else None)
+    set_column('minElevation', min_elevation)
+    set_column('minElevationUncorr', min_elevation if not elevation_corrected else None)
+    set_column('minElevationCorr', min_elevation if elevation_corrected else None)
+    set_column('maxElevation', max_elevation)
+    set_column('maxElevationUncorr', max_elevation if not elevation_corrected else None)
+    set_column('maxElevationCorr', max_elevation if elevation_corrected else None)
+    set_column('elevationCorrected', 'true' if elevation_corrected else 'false')
     # csv_record += empty_record  # no minimum heart rate in JSON
-    csv_filter.set_column('maxHRRaw',
-                          str(details['summaryDTO']['maxHR']) if present('maxHR', details['summaryDTO']) else None)
-    csv_filter.set_column('maxHR', "{0:.0f}".format(actvty['maxHR']) if present('maxHR', actvty) else None)
-    csv_filter.set_column('averageHRRaw', str(details['summaryDTO']['averageHR']) if present('averageHR', details[
-        'summaryDTO']) else None)
-    csv_filter.set_column('averageHR', "{0:.0f}".format(actvty['averageHR']) if present('averageHR', actvty) else None)
-    csv_filter.set_column('caloriesRaw', str(details['summaryDTO']['calories']) if present('calories', details[
-        'summaryDTO']) else None)
-    csv_filter.set_column('calories', "{0:.0f}".format(details['summaryDTO']['calories']) if present('calories',
-                                                                                                     details[
-                                                                                                         'summaryDTO']) else None)
-    csv_filter.set_column('vo2max', str(actvty['vO2MaxValue']) if present('vO2MaxValue', actvty) else None)
-    csv_filter.set_column('aerobicEffect',
-                          str(round(details['summaryDTO']['trainingEffect'], 2)) if present('trainingEffect', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('anaerobicEffect', str(round(details['summaryDTO']['anaerobicTrainingEffect'], 2)) if present(
-        'anaerobicTrainingEffect', details['summaryDTO']) else None)
-    csv_filter.set_column('averageRunCadence',
-                          str(round(details['summaryDTO']['averageRunCadence'], 2)) if present('averageRunCadence',
-                                                                                               details[
-                                                                                                   'summaryDTO']) else None)
-    csv_filter.set_column('maxRunCadence', str(details['summaryDTO']['maxRunCadence']) if present('maxRunCadence',
-                                                                                                  details[
-                                                                                                      'summaryDTO']) else None)
-    csv_filter.set_column('strideLength',
-                          str(round(details['summaryDTO']['strideLength'], 2)) if present('strideLength', details[
-                              'summaryDTO']) else None)
-    csv_filter.set_column('steps', str(actvty['steps']) if present('steps', actvty) else None)
-    csv_filter.set_column('averageCadence', str(actvty['averageBikingCadenceInRevPerMinute']) if present(
-        'averageBikingCadenceInRevPerMinute', actvty) else None)
-    csv_filter.set_column('maxCadence',
-                          str(actvty['maxBikingCadenceInRevPerMinute']) if present('maxBikingCadenceInRevPerMinute',
-                                                                                   actvty) else None)
-    csv_filter.set_column('strokes', str(actvty['strokes']) if present('strokes', actvty) else None)
-    csv_filter.set_column('averageTemperature',
-                          str(details['summaryDTO']['averageTemperature']) if present('averageTemperature',
-                                                                                      details['summaryDTO']) else None)
-    csv_filter.set_column('minTemperature', str(details['summaryDTO']['minTemperature']) if present('minTemperature',
-                                                                                                    details[
-                                                                                                        'summaryDTO']) else None)
-    csv_filter.set_column('maxTemperature', str(details['summaryDTO']['maxTemperature']) if present('maxTemperature',
-                                                                                                    details[
-                                                                                                        'summaryDTO']) else None)
-    csv_filter.set_column('device', extract['device'] if extract['device'] else None)
-    csv_filter.set_column('gear', extract['gear'] if extract['gear'] else None)
-    csv_filter.set_column('activityTypeKey', actvty['activityType']['typeKey'].title() if present('typeKey', actvty[
-        'activityType']) else None)
-    csv_filter.set_column('activityType', value_if_found_else_key(activity_type_name,
-                                                                  'activity_type_' + actvty['activityType'][
-                                                                      'typeKey']) if present('activityType',
-                                                                                             actvty) else None)
-    csv_filter.set_column('activityParent', value_if_found_else_key(activity_type_name,
-                                                                    'activity_type_' + parent_type_key) if parent_type_key else None)
-    csv_filter.set_column('eventTypeKey',
-                          actvty['eventType']['typeKey'].title() if present('typeKey', actvty['eventType']) else None)
-    csv_filter.set_column('eventType',
-                          value_if_found_else_key(event_type_name, actvty['eventType']['typeKey']) if present(
-                              'eventType', actvty) else None)
-    csv_filter.set_column('privacy', details['accessControlRuleDTO']['typeKey'] if present('typeKey', details[
-        'accessControlRuleDTO']) else None)
-    csv_filter.set_column('fileFormat', details['metadataDTO']['fileFormat']['formatKey'] if present('fileFormat',
-                                                                                                     details[
-                                                                                                         'metadataDTO']) and present(
-        'formatKey', details['metadataDTO']['fileFormat']) else None)
-    csv_filter.set_column('tz', details['timeZoneUnitDTO']['timeZone'] if present('timeZone',
-                                                                                  details['timeZoneUnitDTO']) else None)
-    csv_filter.set_column('tzOffset', extract['start_time_with_offset'].isoformat()[-6:])
-    csv_filter.set_column('locationName', details['locationName'] if present('locationName', details) else None)
-    csv_filter.set_column('startLatitudeRaw', str(start_latitude) if start_latitude else None)
-    csv_filter.set_column('startLatitude', trunc6(start_latitude) if start_latitude else None)
-    csv_filter.set_column('startLongitudeRaw', str(start_longitude) if start_longitude else None)
-    csv_filter.set_column('startLongitude', trunc6(start_longitude) if start_longitude else None)
-    csv_filter.set_column('endLatitudeRaw', str(end_latitude) if end_latitude else None)
-    csv_filter.set_column('endLatitude', trunc6(end_latitude) if end_latitude else None)
-    csv_filter.set_column('endLongitudeRaw', str(end_longitude) if end_longitude else None)
-    csv_filter.set_column('endLongitude', trunc6(end_longitude) if end_longitude else None)
-    csv_filter.set_column('sampleCount', str(extract['samples']['metricsCount']) if present('metricsCount', extract[
-        'samples']) else None)
+    csv_filter.set_simple_columns(actvty, summary)
+    set_column('device', extract['device'] if extract['device'] else None)
+    set_column('gear', extract['gear'] if extract['gear'] else None)
+    if type_key:
+        set_column('activityTypeKey', type_key.title())
+        set_column('activityType', activity_type_label.get(type_key) or f'activity_type_{type_key}')
+    if parent_type_key:
+        set_column('activityParent',
+                   activity_type_label.get(parent_type_key) or f'activity_type_{parent_type_key}')
+    if event_type_key:
+        set_column('eventTypeKey', event_type_key.title())
+        set_column('eventType', value_if_found_else_key(event_type_name, event_type_key))
+    set_column('privacy', access_control.get('typeKey'))
+    set_column('fileFormat', (metadata.get('fileFormat') or {}).get('formatKey'))
+    set_column('tz', time_zone.get('timeZone'))
+    set_column('tzOffset', start_time_iso[-6:])
+    set_column('locationName', details.get('locationName'))
+    set_column('startLatitudeRaw', str(start_latitude) if start_latitude else None)
+    set_column('startLatitude', trunc6(start_latitude) if start_latitude else None)
+    set_column('startLongitudeRaw', str(start_longitude) if start_longitude else None)
+    set_column('startLongitude', trunc6(start_longitude) if start_longitude else None)
+    set_column('endLatitudeRaw', str(end_latitude) if end_latitude else None)
+    set_column('endLatitude', trunc6(end_latitude) if end_latitude else None)
+    set_column('endLongitudeRaw', str(end_longitude) if end_longitude else None)
+    set_column('endLongitude', trunc6(end_longitude) if end_longitude else None)
+    metrics_count = samples.get('metricsCount')
+    set_column('sampleCount', str(metrics_count) if metrics_count else None)
 
     csv_filter.write_row()
 
@@ -553,11 +707,21 @@ def write_last_activity_index(settings_dir, activity_index, format):
     """
     settings = read_settings(settings_dir)
     settings['activity_indices'][format] = activity_index
+    write_settings(settings_dir, settings)
 
-    file_name = join(settings_dir, ".settings")
 
-    with open(file_name, "wb") as f:
-        pickle.dump(settings, f)
+def write_settings(settings_dir, settings):
+    """
+    Persists the settings dictionary to the given download dir (see also method read_settings())
+    :param settings_dir: Path to the pickle file
+    :param settings: dictionary as returned by read_settings()
+    """
+    file_name = join(settings_dir, ".settings")
+    # write a temporary file and move it into place, so an aborted run cannot leave a truncated .settings
+    temp_file_name = file_name + ".tmp"
+    with open(temp_file_name, "wb") as f:
+        pickle.dump(settings, f, protocol=pickle.HIGHEST_PROTOCOL)
+    replace(temp_file_name, file_name)
 
 
 def read_settings(settings_dir):
@@ -575,25 +739,79 @@ def read_settings(settings_dir):
         with open(file_name, "rb") as f:
             pick = pickle.load(f)
             return pick
-    except IOError:
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        # a missing or damaged file is the same as no settings at all
         return dict(activity_indices=dict(tcx=0, gpx=0, json=0, original=0))
 
 
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Create the HTTP session for Garmin Connect, keeping up to pool_size connections
+    per host alive and retrying failed requests
+    """
+    session = requests.Session()
+    # back off and retry idempotent requests on throttling and server errors, honouring Retry-After;
+    # once the retries are used up, return the last response so the callers' status checks handle it
+    retries = Retry(total=MAX_TRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=['GET'], respect_retry_after_header=True, raise_on_status=False)
+    # reuse keep-alive connections instead of a new TCP/TLS handshake per request
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
 class GarminConnect(object):
     """ Class to represent connection to GarminConnect"""
 
-    urls = load_yaml(Path(__file__).parent.joinpath("settings.yaml"))["urls"]
+    urls = SimpleNamespace(**load_yaml(Path(__file__).parent.joinpath("settings.yaml"))["urls"])
 
-    def __init__(self, username: str = None, password: str = None, export_dir: Path = None):
-        self.session = requests.Session()  # main session object to hold all cookies, requests etc
+    def __init__(self, username: str = None, password: str = None, export_dir: Path = None,
+                 max_workers: int = MAX_WORKERS, quiet: bool = False):
+        # main session object to hold all cookies, requests etc
+        # keep a connection per worker thread (plus the activity list thread) alive, so none is discarded
+        self.session = create_session(max(HTTP_POOL_SIZE, max_workers + 1))
         self.export_dir = export_dir or Path("exports")
+        self.max_workers = max_workers
+        self.quiet = quiet
+        # download url per format (JSON is written from the activity details, no download)
+        self.activity_urls = {fmt: getattr(self.urls, f'{fmt}_ACTIVITY') for fmt in DOWNLOAD_FORMATS if fmt != 'JSON'}
+        # device names by deviceApplicationInstallationId, kept across runs in the .settings file;
+        # guarded by the lock as it is shared by the threads processing the activities
+        self.device_dict = read_settings(self.export_dir).get('device_dict', {})
+        self._device_lock = threading.Lock()
+        # devices whose lookup failed; their placeholders are used for this run only, not persisted
+        self._failed_devices = set()
+        # names of the files in export_dir, listed once by get_activities (None: check the filesystem)
+        self._existing_files = None
+        # ids of the activities exported by get_activities, including the ones skipped as exported before
+        self._exported_ids = set()
 
         self.auth_ticket = self.login(self.session, username, password)
 
         self.activity_tyes = self.get_activity_types()
+        self.activity_type_label = activity_type_labels(self.activity_tyes)
         self.event_types = self.get_event_types()
         self.userstats = self.get_userstats()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Close the connections of the session """
+        self.session.close()
+
+    def _get_json(self, url: str, params: Dict = None):
+        """ GET url and decode the JSON body, None if the request failed """
+        resp = self.session.get(url, params=params, stream=False, timeout=HTTP_TIMEOUT)
+        if not resp.ok:
+            return None
+        return json_loads(resp.content)
+
     def login(self, session: requests.Session, username: str, password: str) -> str:
         """
         Perform all HTTP requests to login to Garmin Connect.
@@ -602,8 +820,8 @@ class GarminConnect(object):
         password = password or getpass()
 
         logger.info('Connecting to Garmin Connect...')
-        logger.info('Connecting to %s', self.urls["LOGIN"])
-        connect_response = session.get(self.urls["LOGIN"], params=LOGIN_PARAMS)
+        logger.info('Connecting to %s', self.urls.LOGIN)
+        connect_response = session.get(self.urls.LOGIN, params=LOGIN_PARAMS, timeout=HTTP_TIMEOUT)
 
         # Fields that are passed in a typical Garmin login.
         post_data = {
@@ -614,44 +832,56 @@ class GarminConnect(object):
         }
 
         headers = {
-            'referer': self.urls["LOGIN"]
+            'referer': self.urls.LOGIN
         }
 
         logger.info('Requesting Login ticket...')
-        login_req = session.post(self.urls["LOGIN"], params=LOGIN_PARAMS, data=post_data, headers=headers)
+        login_req = session.post(self.urls.LOGIN, params=LOGIN_PARAMS, data=post_data, headers=headers,
+                                 timeout=HTTP_TIMEOUT)
 
         # Extract the ticket from the login response
-        pattern = re.compile(r".*\?ticket=([-\w]+)\";.*", re.MULTILINE | re.DOTALL)
-        match = pattern.match(login_req.text)
-        if not match:
+        login_ticket = extract_login_ticket(login_req.content)
+        if not login_ticket:
             raise RuntimeError('Couldn\'t find ticket in the login response. Cannot log in. '
                                'Did you enter the correct username and password?')
-        login_ticket = match.group(1)
         print(' Done. Ticket=' + login_ticket)
 
         print("Authenticating...", end='')
-        logging.info(f"Authentication URL {self.urls['POST_AUTH']},  ticket={login_ticket}")
-        session.get(self.urls["POST_AUTH"], params={'ticket': login_ticket})
+        logging.info("Authentication URL %s,  ticket=%s", self.urls.POST_AUTH, login_ticket)
+        session.get(self.urls.POST_AUTH, params={'ticket': login_ticket}, timeout=HTTP_TIMEOUT)
 
         return login_ticket
 
     def get_userstats(self) -> Dict:
         """ Get user stats and return dict from JSON response"""
         logging.info('Fetching user stats...')
-        logging.info('Userstats page %s', self.urls["USERSTATS"])
-        user_stats_req = self.session.get(self.urls["USERSTATS"])
+        logging.info('Userstats page %s', self.urls.USERSTATS)
+        user_stats_req = self.session.get(self.urls.USERSTATS, timeout=HTTP_TIMEOUT)
         if user_stats_req.ok is True:
-            return json.loads(user_stats_req.text)
+            return json_loads(user_stats_req.content)
         else:
             raise requests.HTTPError("Could not get user stats!")
 
     def get_activity_types(self) -> Dict:
-        activity_type_req = self.session.get(self.urls["ACT_PROPS"])
-        return load_properties(activity_type_req.text)
+        return self.get_properties(self.urls.ACT_PROPS)
 
     def get_event_types(self) -> Dict:
-        event_type_req = self.session.get(self.urls["EVT_PROPS"])
-        return load_properties(event_type_req.text)
+        return self.get_properties(self.urls.EVT_PROPS)
+
+    def get_properties(self, url: str) -> Dict:
+        """ Get a properties file as dict, cached for PROPERTIES_MAX_AGE in the .settings file """
+        settings = read_settings(self.export_dir)
+        cached = settings.setdefault('properties', {})
+        fetched, properties = cached.get(url, (None, None))
+        now = datetime.now(timezone.utc)
+        if fetched is None or now - fetched > PROPERTIES_MAX_AGE:
+            properties_req = self.session.get(url, timeout=HTTP_TIMEOUT)
+            properties = load_properties(properties_req.text)
+            # the constructor does not create the export directory, so only cache into an existing one
+            if properties_req.ok and self.export_dir.is_dir():
+                cached[url] = (now, properties)
+                write_settings(self.export_dir, settings)
+        return properties
 
     def get_n_activites(self, count: Union[int, str]) -> int:
         """
@@ -681,105 +911,203 @@ class GarminConnect(object):
         # the https://connect.garmin.com/modern/activity/xxx page), because some
         # data are missing from 'a' (or are even different)
 
-        for tries in range(MAX_TRIES):
-            activity_details_req = self.session.get(self.urls["ACTIVITY"] + f"/{activity_id}")
-            details = json.loads(activity_details_req.text)
+        # the details of activities processed before are kept on disk, so re-runs need not fetch them again
+        details_filename = self.export_dir.joinpath(f"detail_{activity_id}.json")
+        if self._file_exists(details_filename):
+            try:
+                details = json_loads(details_filename.read_bytes())
+            except ValueError:  # e.g. truncated by an aborted run
+                details = {}
+            if details.get('summaryDTO') is not None:
+                return details
+
+        for tries in range(DETAILS_TRIES):
+            details_req = self.session.get(self.urls.ACTIVITY + f"/{activity_id}", timeout=HTTP_TIMEOUT)
+            details = json_loads(details_req.content) if details_req.ok else {}
             if details.get('summaryDTO') is not None:
+                details_filename.write_bytes(details_req.content)
                 break
             else:
-                logging.warning(
-                    f"Retrying activity details download for activityId {activity_id}")
+                logging.warning("Retrying activity details download for activityId %s", activity_id)
         else:  # no break
             raise RuntimeError(
-                f"Did not get summaryDTO after {MAX_TRIES} tries for activityId {activity_id}")
+                f"Did not get summaryDTO after {DETAILS_TRIES} tries for activityId {activity_id}")
 
         return details
 
-    def get_activities(self, count: Union[int, str]):
+    def _get_required_details(self, activity_id: str) -> Dict:
+        """ Gets the activity details, keeping only the keys needed to export the activity """
+        return required_details(self.get_activity_details(activity_id))
+
+    def get_activity_list(self, start: int, limit: int):
+        """ Gets the summaries of *limit* activities, starting with the *start*-th newest one """
+        search_params = {'start': start, 'limit': limit}
+        activity_list_req = self.session.get(self.urls.LIST, params=search_params, timeout=HTTP_TIMEOUT)
+
+        # TODO Cache activities
+
+        return json_loads(activity_list_req.content)
+
+    def get_activities(self, count: Union[int, str], csv_filter: CsvFilter = None,
+                       exported_ids: AbstractSet[str] = frozenset(), skip_downloaded: bool = False):
+        """
+        Export the activities, writing their records to csv_filter if given; the activities in exported_ids
+        (e.g. the ids in an existing CSV file) are left out completely (no details, no download, no CSV record),
+        with skip_downloaded also the ones whose file was downloaded before. The ids of the exported activities
+        are kept in the .settings file.
+        """
+        self._exported_ids = set(exported_ids)
         downloaded_n = 0
-        device_dict = dict()  # TODO Read from cache?
         total_n = self.get_n_activites(count)
-
-        # This while loop will download data from the server in multiple chunks, if necessary.
-        while downloaded_n < total_n:
-            # Maximum chunk size 'LIMIT_MAXIMUM' ... 400 return status if over maximum.  So download
-            # maximum or whatever remains if less than maximum.
-            # As of 2018-03-06 I get return status 500 if over maximum
-            if total_n - downloaded_n > LIMIT_MAXIMUM:
-                num_to_download = LIMIT_MAXIMUM
-            else:
-                num_to_download = total_n - downloaded_n
-
-            search_params = {'start': downloaded_n, 'limit': num_to_download}
-            activity_list_req = self.session.get(self.urls["LIST"], params=search_params)
-
-            # TODO Cache activities
-
-            all_activities = json.loads(activity_list_req.text)
-            if len(all_activities) != num_to_download:
-                logging.warning('Expected %s activities, got %s.', num_to_download, len(all_activities))
-
-            # Process each activity; start with the oldest one
-            for i, activity in tqdm(enumerate(reversed(all_activities)), total=len(all_activities)):
-                activity_id = str(activity['activityId'])
-                logger.info(f"Processing Garmin Connect activity_id {activity_id}: {activity['activityName']}")
-                activity_details = self.get_activity_details(activity_id=activity_id)
-
-                extract = {}
-                extract['start_time_with_offset'] = offset_date_time(activity['startTimeLocal'],
-                                                                     activity['startTimeGMT'])
-                elapsed_duration = activity_details['summaryDTO'][
-                    'elapsedDuration'] if 'summaryDTO' in activity_details and 'elapsedDuration' in activity_details[
-                    'summaryDTO'] else None
-                extract['elapsed_duration'] = elapsed_duration if elapsed_duration else activity['duration']
-                extract['elapsed_seconds'] = int(round(extract['elapsed_duration']))
-                extract['end_time_with_offset'] = extract['start_time_with_offset'] + timedelta(
-                    seconds=extract['elapsed_seconds'])
-
-                print('\t' + extract['start_time_with_offset'].isoformat() + ', ', end='')
-                print(hhmmss_from_seconds(extract['elapsed_seconds']) + ', ', end='')
-                if 'distance' in activity and isinstance(activity['distance'], (float)):
-                    print("{0:.3f}".format(activity['distance'] / 1000) + 'km')
+        # one directory listing instead of a stat() per activity to find the files downloaded before
+        try:
+            self._existing_files = {entry.name for entry in scandir(self.export_dir)}
+        except FileNotFoundError:
+            self._existing_files = set()
+
+        # the activity list is fetched on its own thread, so the next chunk's list can be on its way
+        with ThreadPoolExecutor(max_workers=1) as list_executor:
+            next_list = None
+            # This while loop will download data from the server in multiple chunks, if necessary.
+            while downloaded_n < total_n:
+                # Maximum chunk size 'LIMIT_MAXIMUM' ... 400 return status if over maximum.  So download
+                # maximum or whatever remains if less than maximum.
+                # As of 2018-03-06 I get return status 500 if over maximum
+                num_to_download = min(LIMIT_MAXIMUM, total_n - downloaded_n)
+                if next_list is None:
+                    next_list = list_executor.submit(self.get_activity_list, downloaded_n, num_to_download)
+                all_activities = next_list.result()
+
+                # request the list of the following chunk while this one is processed
+                next_start = downloaded_n + num_to_download
+                if next_start < total_n:
+                    next_list = list_executor.submit(self.get_activity_list, next_start,
+                                                     min(LIMIT_MAXIMUM, total_n - next_start))
                 else:
-                    print('0.000 km')
-
-                extract['device'] = self.extract_device(device_dict, activity_details)
-
-                # try to get the JSON with all the samples (not all activities have it...),
-                # but only if it's really needed for the CSV output
-                # extract['samples'] = None
-                # if csv_filter.is_column_active('sampleCount'):
-                #     try:
-                #         # TODO implement retries here, I have observed temporary failures
-                #         activity_measurements = session.get(
-                #             ACTIVITY + activity_id + "/details").text
-                #         write_to_file(args["directory"] + '/activity_' + activity_id + '_samples.json',
-                #                       activity_measurements, 'w',
-                #                       start_time_seconds)
-                #         samples = json.loads(activity_measurements)
-                #         extract['samples'] = samples
-                #     except urllib.error.HTTPError:
-                #         pass  # don't abort just for missing samples...
-                #         # logging.info("Unable to get samples for %d", actvty['activityId'])
-                #         # logging.exception(e)
-
-                extract['gear'] = self.load_gear(activity_id)
-
-                # Write stats to CSV.
-                # csv_write_record(csv_filter, extract, activity, details, activity_type_name, event_type_name)
-
-                self.download_activity(activity_details, activity['startTimeLocal'], format="ORIGINAL")
-
-                # # Regardless if file was written or already exists
-                # write_last_activity_index(args["directory"],
-                #                           int(json_results['userMetrics'][0]['totalActivities']) -
-                #                           total_n + current_index,
-                #                           args["format"])
-
-            # End for loop for activities of chunk
-            downloaded_n += num_to_download
-
-    def extract_device(self, device_dict: Dict, activity_details: Dict):
+                    next_list = None
+
+                n_activities = len(all_activities)
+                if n_activities != num_to_download:
+                    logging.warning('Expected %s activities, got %s.', num_to_download, n_activities)
+
+                # Process the activities concurrently, as this is dominated by the HTTP round trips;
+                # map() returns the results in order, so the output still starts with the oldest activity
+                chunk_activities = []
+                for activity in reversed(all_activities):
+                    if str(activity['activityId']) in self._exported_ids or (skip_downloaded and self._file_exists(
+                            self._expected_filename(activity['activityId'], activity['startTimeLocal']))):
+                        logger.debug("Skipping already exported activity_id %s", activity['activityId'])
+                    else:
+                        chunk_activities.append(activity)
+                try:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                        try:
+                            self._export_chunk(executor, chunk_activities, csv_filter)
+                        except BaseException:
+                            # leaving the with block waits for every activity of the chunk, so drop the ones
+                            # not started yet when an activity fails or the export is interrupted
+                            executor.shutdown(wait=False, cancel_futures=True)
+                            raise
+                finally:
+                    # the CSV records and the kept ids mark the activities as exported, so get both on disk
+                    # chunk by chunk, and for the activities exported before an abort
+                    if csv_filter is not None:
+                        csv_filter.flush()
+                    self.write_settings_cache()
+
+                # End for loop for activities of chunk
+                downloaded_n += num_to_download
+
+    def _export_chunk(self, executor: ThreadPoolExecutor, chunk_activities, csv_filter: CsvFilter = None):
+        """
+        Process the activities of a chunk on the executor, writing their records to csv_filter
+        (if given) in the order of chunk_activities
+        """
+        # fetch all details first, so the devices of the chunk can be looked up in one go
+        chunk_details = list(executor.map(self._get_required_details,
+                                          (str(activity['activityId']) for activity in chunk_activities)))
+        self._prefetch_devices(executor, chunk_details)
+        results = executor.map(self._process_one_activity, chunk_activities, chunk_details)
+        for activity, (extract, activity_details) in tqdm(zip(chunk_activities, results),
+                                                          total=len(chunk_activities)):
+            distance = activity.get('distance')
+            distance = f"{distance / 1000:.3f}km" if isinstance(distance, float) else '0.000 km'
+            if self.quiet:
+                logger.info("Exported %s, %s, %s", extract['start_time_with_offset'].isoformat(),
+                            hhmmss_from_seconds(extract['elapsed_seconds']), distance)
+            else:
+                tqdm.write(f"\t{extract['start_time_with_offset'].isoformat()}, "
+                           f"{hhmmss_from_seconds(extract['elapsed_seconds'])}, {distance}")
+
+            # Write stats to CSV.
+            if csv_filter is not None:
+                csv_write_record(csv_filter, extract, activity, activity_details, self.activity_type_label,
+                                 self.event_types)
+            self._exported_ids.add(str(activity['activityId']))
+
+            # # Regardless if file was written or already exists
+            # write_last_activity_index(args["directory"],
+            #                           int(json_results['userMetrics'][0]['totalActivities']) -
+            #                           total_n + current_index,
+            #                           args["format"])
+
+    def write_settings_cache(self):
+        """
+        Persist the device cache and the ids of the exported activities to the .settings file in the export
+        directory, leaving out failed and incomplete device lookups, so a later run tries them again
+        """
+        settings = read_settings(self.export_dir)
+        settings['exported_ids'] = set(self._exported_ids)
+        with self._device_lock:
+            settings['device_dict'] = {device_app_inst_id: device
+                                       for device_app_inst_id, device in self.device_dict.items()
+                                       if device is not None and device_app_inst_id not in self._failed_devices}
+        write_settings(self.export_dir, settings)
+
+    def _process_one_activity(self, activity: Dict, activity_details: Dict):
+        """
+        Extract the times, device and gear of an activity and download its file;
+        runs on a worker thread. Returns the tuple (extract, activity_details).
+        """
+        activity_id = str(activity['activityId'])
+        logger.info("Processing Garmin Connect activity_id %s: %s", activity_id, activity['activityName'])
+
+        extract = {}
+        extract['start_time_with_offset'] = offset_date_time(activity['startTimeLocal'],
+                                                             activity['startTimeGMT'])
+        summary = activity_details.get('summaryDTO') or {}
+        extract['elapsed_duration'] = summary.get('elapsedDuration') or activity['duration']
+        extract['elapsed_seconds'] = int(round(extract['elapsed_duration']))
+        extract['end_time_with_offset'] = extract['start_time_with_offset'] + timedelta(
+            seconds=extract['elapsed_seconds'])
+
+        extract['device'] = self.extract_device(activity_details)
+
+        # try to get the JSON with all the samples (not all activities have it...),
+        # but only if it's really needed for the CSV output
+        extract['samples'] = None
+        # if csv_filter.is_column_active('sampleCount'):
+        #     try:
+        #         # TODO implement retries here, I have observed temporary failures
+        #         activity_measurements = session.get(
+        #             ACTIVITY + activity_id + "/details").text
+        #         write_to_file(args["directory"] + '/activity_' + activity_id + '_samples.json',
+        #                       activity_measurements, 'w',
+        #                       start_time_seconds)
+        #         samples = json.loads(activity_measurements)
+        #         extract['samples'] = samples
+        #     except urllib.error.HTTPError:
+        #         pass  # don't abort just for missing samples...
+        #         # logging.info("Unable to get samples for %d", actvty['activityId'])
+        #         # logging.exception(e)
+
+        extract['gear'] = self.load_gear(activity_id)
+
+        self.download_activity(activity_details, activity['startTimeLocal'], format="ORIGINAL")
+
+        return extract, activity_details
+
+    def extract_device(self, activity_details: Dict):
         """
         Try to get the device activity_details (and cache them, as they're used for multiple activities)
         """
@@ -790,39 +1118,67 @@ class GarminConnect(object):
             metadata = activity_details['metadataDTO']
             device_app_inst_id = metadata.get('deviceApplicationInstallationId')
 
-        if device_app_inst_id is not None:
-            if device_app_inst_id not in device_dict:
-                # observed from my stock of activities:
-                # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == null -> device unknown
-                # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == '0' -> device unknown
-                # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == 'someid' -> device known
-                device_dict[device_app_inst_id] = None
-                device_meta = metadata.get('deviceMetaDataDTO')
-                device_id = device_meta.get('deviceId')
-                if 'deviceId' not in device_meta or device_id and device_id != '0':
-                    device_json_req = self.session.get(self.urls["DEVICE"] + str(device_app_inst_id))
-                    # export_dir.joinpath(f"device_{device_app_inst_id}.json").write_text(device_json_req.text)
-                    if device_json_req.ok is False:
-                        logging.warning(f"Device Details {device_app_inst_id} are empty")
-                        device_dict[device_app_inst_id] = "device-id:" + str(device_app_inst_id)
-                    else:
-                        device_details = json.loads(device_json_req.text)
-                        if 'productDisplayName' in device_details:
-                            device_dict[device_app_inst_id] = device_details['productDisplayName'] + ' ' \
-                                                              + device_details['versionString']
-                        else:
-                            logging.warning(f"Device activity_details {device_app_inst_id} incomplete")
-            return device_dict[device_app_inst_id]
-        else:
+        if device_app_inst_id is None:
+            return None
+        # usually prefetched, so a single lookup without taking the lock
+        device = self.device_dict.get(device_app_inst_id, _MISSING)
+        if device is not _MISSING:
+            return device
+        # the lock makes sure each device is only fetched once, even when requested by several threads
+        with self._device_lock:
+            device = self.device_dict.get(device_app_inst_id, _MISSING)
+            if device is _MISSING:
+                device = self.load_device(device_app_inst_id, metadata.get('deviceMetaDataDTO'))
+                self.device_dict[device_app_inst_id] = device
+            return device
+
+    def _prefetch_devices(self, executor: ThreadPoolExecutor, activity_details_list):
+        """
+        Fetch the devices of a chunk that are not in the device cache yet concurrently,
+        so extract_device only has to look them up
+        """
+        pending = {}
+        for activity_details in activity_details_list:
+            metadata = activity_details.get('metadataDTO') or {}
+            device_app_inst_id = metadata.get('deviceApplicationInstallationId')
+            if device_app_inst_id is not None and device_app_inst_id not in self.device_dict:
+                pending[device_app_inst_id] = metadata.get('deviceMetaDataDTO')
+        devices = list(executor.map(self.load_device, pending.keys(), pending.values()))
+        with self._device_lock:
+            self.device_dict.update(zip(pending, devices))
+
+    def load_device(self, device_app_inst_id, device_meta: Dict):
+        """ Retrieve the name of a device, None if the device is unknown """
+        # observed from my stock of activities:
+        # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == null -> device unknown
+        # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == '0' -> device unknown
+        # activity_details['metadataDTO']['deviceMetaDataDTO']['deviceId'] == 'someid' -> device known
+        device_meta = device_meta or {}
+        device_id = device_meta.get('deviceId')
+        if 'deviceId' in device_meta and not (device_id and device_id != '0'):
             return None
+        try:
+            device_json_req = self.session.get(self.urls.DEVICE + str(device_app_inst_id), timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            # timed out or failed even after the session's retries; don't abort just for a device name
+            logging.warning("Device Details %s could not be fetched: %s", device_app_inst_id, e)
+            device_json_req = None
+        # export_dir.joinpath(f"device_{device_app_inst_id}.json").write_text(device_json_req.text)
+        if device_json_req is None or device_json_req.ok is False:
+            logging.warning("Device Details %s are empty", device_app_inst_id)
+            self._failed_devices.add(device_app_inst_id)
+            return "device-id:" + str(device_app_inst_id)
+        device_details = json_loads(device_json_req.content)
+        if 'productDisplayName' in device_details:
+            return device_details['productDisplayName'] + ' ' + device_details['versionString']
+        logging.warning("Device activity_details %s incomplete", device_app_inst_id)
+        return None
 
     def load_gear(self, activity_id: str):
         """ Retrieve the gear/equipment for an activity """
 
-        gear_req = self.session.get(f"{self.urls['GEAR']}/{activity_id}")
-        if gear_req.ok is True:
-            params = {"activityId": activity_id}
-            gear = json.loads(gear_req.text)
+        gear = self._get_json(f"{self.urls.GEAR}/{activity_id}")
+        if gear is not None:
             if len(gear) > 0:
                 gear_display_name = gear[0].get('displayName')
                 gear_model = gear[0].get('customMakeModel')
@@ -831,69 +1187,108 @@ class GarminConnect(object):
             else:
                 return None
         else:
-            logging.debug(f"Unable to get gear for activity_id {activity_id}")
+            logging.debug("Unable to get gear for activity_id %s", activity_id)
             return None  # Don't abort just for missing gear
 
+    def _file_exists(self, path: Path) -> bool:
+        """ Check for a file in export_dir, using the listing of get_activities if there is one """
+        if self._existing_files is None:
+            return path.exists()
+        return path.name in self._existing_files
+
+    def _expected_filename(self, activity_id, start_time_locale, format: str = "ORIGINAL") -> Path:
+        """ Path the file of an activity is (or will be) downloaded to """
+        start_time_locale = get_valid_filename(start_time_locale)  # Remove illegal characters
+        extension = "zip" if format == "ORIGINAL" else format
+        return self.export_dir.joinpath(f"{start_time_locale}_{activity_id}.{extension}")
+
     def download_activity(self, activity_details: Dict, start_time_locale, format: str = "ORIGINAL"):
         """
         Write the data of the activity to a file, depending on the chosen data format
         """
-        allowed_formats = ["ORIGINAL", "GPX", "JSON"]
-        if format not in allowed_formats:
-            raise ValueError(f"format '{format}' not recognised. Must be one of {allowed_formats}")
+        if format not in DOWNLOAD_FORMATS:
+            raise ValueError(f"format '{format}' not recognised. Must be one of {sorted(DOWNLOAD_FORMATS)}")
         activity_id = activity_details["activityId"]
 
-        download_url = f"{self.urls[f'{format.upper()}_ACTIVITY']}/{activity_id}"
         download_params = {"full": "true"}
-        start_time_locale = get_valid_filename(start_time_locale)  # Remove illegal characters
-        if format != "ORIGINAL":
-            download_filename = self.export_dir.joinpath(f"{start_time_locale}_{activity_id}.{format}")
-        else:
-            download_filename = self.export_dir.joinpath(f"{start_time_locale}_{activity_id}.zip")
+        download_filename = self._expected_filename(activity_id, start_time_locale, format)
 
-        if download_filename.exists():
-            logger.debug(f"Skipping already-existing file: {download_filename}")
+        if self._file_exists(download_filename):
+            logger.debug("Skipping already-existing file: %s", download_filename)
             return False
 
-        if format != 'JSON':
-            dl_req = self.session.get(download_url, params=download_params)
-
-            # Handle expected (though unfortunate) error codes; die on unexpected ones.
-            if dl_req.status_code == 404 and format == "ORIGINAL":
-                # For manual activities (i.e., entered in online without a file upload), there is
-                # no original file. Write an empty file to prevent redownloading it.
-                logging.info('Writing empty file since there was no original activity data...')
-                raw_data = b''
-            elif dl_req.ok is False:
-                raise Exception('Failed. Got an HTTP error ' + str(dl_req.status_code) + ' for ' + download_url)
-            else:
-                raw_data = dl_req.content
-
+        if format == 'JSON':
+            download_filename.write_bytes(json_dumps(activity_details))
         else:
-            raw_data = activity_details
-
-        Path(download_filename).absolute().write_bytes(raw_data)
-
-        # Persist file
-        if format == 'ORIGINAL':
-            # Even manual upload of a GPX file is zipped, but we'll validate the extension.
-            file_size = stat(download_filename).st_size
-            logging.debug(f"Unzipping and removing original file, size is {file_size}")
-            if file_size > 0:
-                with open(download_filename, "rb") as zip_file:
-                    zip_obj = zipfile.ZipFile(zip_file)
-                    for name in zip_obj.namelist():
-                        unzipped_name = Path(zip_obj.extract(name, self.export_dir))
-                        file_type = unzipped_name.suffix
-                        new_name = download_filename.with_suffix(file_type)
-                        logging.debug(f"Renaming {unzipped_name} to {new_name}")
-                        unzipped_name.rename(new_name)
-            else:
-                logger.warning(f"Skipping 0Kb zip file for activity_id {activity_id}")
-                Path(download_filename).unlink()
+            # download (and unzip) into a temporary file and give it its final name only when complete,
+            # so an interrupted download leaves no file that a re-run would take for an exported activity
+            part_filename = download_filename.with_suffix('.part')
+            try:
+                download_url = f"{self.activity_urls[format]}/{activity_id}"
+                with self.session.get(download_url, params=download_params, stream=True,
+                                      timeout=DOWNLOAD_TIMEOUT) as dl_req:
+                    # Handle expected (though unfortunate) error codes; die on unexpected ones.
+                    if dl_req.status_code == 404 and format == "ORIGINAL":
+                        # For manual activities (i.e., entered in online without a file upload), there is
+                        # no original file.
+                        logging.info('No original activity data for activity_id %s', activity_id)
+                        file_size = 0
+                    elif dl_req.ok is False:
+                        raise Exception('Failed. Got an HTTP error ' + str(dl_req.status_code) + ' for ' + download_url)
+                    else:
+                        file_size = stream_to_file(part_filename, dl_req)
+
+                if format == 'ORIGINAL':
+                    # Even manual upload of a GPX file is zipped, but we'll validate the extension.
+                    logging.debug("Unzipping original file, size is %s", file_size)
+                    if file_size == 0:
+                        logger.warning("Skipping 0Kb zip file for activity_id %s", activity_id)
+                        part_filename.unlink(missing_ok=True)
+                        return True
+                    with zipfile.ZipFile(part_filename) as zip_obj:
+                        for name in zip_obj.namelist():
+                            new_name = download_filename.with_suffix(Path(name).suffix)
+                            logging.debug("Unzipping %s to %s", name, new_name)
+                            # copy in blocks, so a large track is never held in memory as a whole
+                            with zip_obj.open(name) as entry, \
+                                    open(new_name, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                                shutil.copyfileobj(entry, f, WRITE_BUFFER_SIZE)
+                part_filename.replace(download_filename)
+            except BaseException:
+                part_filename.unlink(missing_ok=True)
+                raise
+
+        if self._existing_files is not None:
+            self._existing_files.add(download_filename.name)
         return True
 
 
+def export_activities(garmin_connect: GarminConnect, export_csv: Path, template=CSV_TEMPLATE):
+    """
+    Export the activities that have no record in the CSV file export_csv yet,
+    appending their records to it (a new CSV file gets the records of all activities)
+    """
+    # the CSV records are small, so let a large buffer collect them instead of writing each one
+    csv_existed = export_csv.exists() and export_csv.stat().st_size > 0
+    with open(export_csv, 'a', newline='', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as csv_file:
+        csv_filter = CsvFilter(csv_file, template)
+        exported_ids = csv_filter.read_column(export_csv, 'id')
+        skip_downloaded = False
+        if exported_ids is None:
+            # the template has no id column, so use the ids kept by the previous runs; a CSV file written
+            # before the ids were kept is continued after the activities whose file was downloaded
+            exported_ids = read_settings(garmin_connect.export_dir).get('exported_ids', set())
+            skip_downloaded = True
+        if not csv_existed:
+            csv_filter.write_header()
+        try:
+            garmin_connect.get_activities(count="all", csv_filter=csv_filter, exported_ids=exported_ids,
+                                          skip_downloaded=skip_downloaded)
+        finally:
+            # also keep the records collected so far if the export is aborted
+            csv_filter.flush()
+
+
 def main(**kwargs):
     """
     Main entry point for gcexport.py
@@ -902,7 +1297,7 @@ def main(**kwargs):
     if len(kwargs) > 0:
         args = kwargs
         for key, value in kwargs.items():
-            logging.debug(f"arg : {key} | value : {value}")
+            logging.debug("arg : %s | value : %s", key, value)
     else:
         args = parse_arguments()
 
@@ -915,13 +1310,16 @@ def main(**kwargs):
     export_dir.mkdir(parents=True, exist_ok=True)
     export_csv = export_dir.joinpath("activities.csv")
 
-    garmin_connect = GarminConnect(username=args.get("username"), password=args.get("password"), export_dir=export_dir)
+    garmin_connect = GarminConnect(username=args.get("username"), password=args.get("password"), export_dir=export_dir,
+                                   max_workers=args.get("workers", MAX_WORKERS), quiet=bool(args.get("quiet")))
 
-    activities = garmin_connect.get_activities(count="all")
+    with garmin_connect:
+        export_activities(garmin_connect, export_csv, args.get("template", CSV_TEMPLATE))
 
-    logger.debug(pprint(garmin_connect.userstats, width=200))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(pformat(garmin_connect.userstats, width=200))
 
-    logger.info(f"Export completed to {export_dir}")
+    logger.info("Export completed to %s", export_dir)
 
 
 if __name__ == "__main__":
@@ -9,14 +9,14 @@ from gcexport import *
 from StringIO import StringIO
 
 
-def test_pace_or_speed_raw_cycling():
+def test_pace_or_speed_strings_cycling():
     # 10 m/s is 36 km/h
-    assert pace_or_speed_raw(2, 4, 10.0) == 36.0
+    assert pace_or_speed_strings(uses_pace(2, 4), 10.0)[0] == '36.000000'
 
 
-def test_pace_or_speed_raw_running():
+def test_pace_or_speed_strings_running():
     # 3.33 m/s is 12 km/h is 5 min/km
-    assert pace_or_speed_raw(1, 4, 10.0/3) == 5.0
+    assert pace_or_speed_strings(uses_pace(1, 4), 10.0/3)[0] == '5.000000'
 
 
 def test_trunc6_more():
@@ -15,6 +15,11 @@ from pathlib import Path
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 def setup_logging(log_config_path=f"{Path(__file__).parent}/logging_config.yaml", log_dir="logs", module_name=None,
                   default_level=logging.INFO) -> (logging.Logger, str):
@@ -47,7 +52,7 @@ def setup_logging(log_config_path=f"{Path(__file__).parent}/logging_config.yaml"
 
     if os.path.exists(log_config_path):
         with open(log_config_path, 'rt') as f:
-            config = yaml.safe_load(f.read())
+            config = yaml.load(f, Loader=SafeLoader)
 
         # Set
         for handler_name, handler in config["handlers"].items():
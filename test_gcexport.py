@@ -1,5 +1,100 @@
+import csv
+import io
+import json
+import zipfile
+from argparse import ArgumentTypeError
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
-from gcexport import resolve_path
+from unittest.mock import patch
+
+import requests
+
+from gcexport import CSV_TEMPLATE, CsvFilter, FixedOffset, GarminConnect, create_session, export_activities, \
+    extract_login_ticket, from_activities_or_detail, hhmmss_from_seconds, offset_date_time, pace_or_speed_strings, \
+    positive_int, read_settings, resolve_path, sanitize_filename, trunc6, uses_pace, write_last_activity_index
+
+FIXTURES = Path(__file__).parent.joinpath('json')
+
+
+def fake_response(status, body=b''):
+    """Build a requests.Response with the given status and body, also readable as a stream"""
+    response = requests.Response()
+    response.status_code = status
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class DroppedStream(io.BytesIO):
+    """A response body whose connection drops after the first 10 bytes"""
+
+    def read(self, size=-1):
+        if self.tell() >= 10:
+            raise requests.ConnectionError("connection dropped")
+        return super().read(10)
+
+
+class FakeGarminSession(requests.Session):
+    """Answers the requests of an export from the JSON fixtures instead of Garmin Connect"""
+
+    def __init__(self, n_activities, missing_originals=(), failing_originals=(), dropped_originals=()):
+        super().__init__()
+        template = json.loads(FIXTURES.joinpath('activitylist-service.json').read_text(encoding='utf-8'))[0]
+        # newest first, like Garmin; the activity ids are 1...n_activities
+        self.activities = [dict(template, activityId=n, startTimeLocal=f"2018-03-{n:02d} 12:23:22",
+                                startTimeGMT=f"2018-03-{n:02d} 11:23:22") for n in range(n_activities, 0, -1)]
+        self.details = json.loads(FIXTURES.joinpath('activity_2541953812.json').read_text(encoding='utf-8'))
+        # ids of activities without original file (manual activities), or with a failing or dropped download
+        self.missing_originals = missing_originals
+        self.failing_originals = failing_originals
+        self.dropped_originals = dropped_originals
+        self.requested = []
+
+    def request(self, method, url, params=None, **kwargs):
+        urls = GarminConnect.urls
+        self.requested.append(url)
+        activity_id = url.rsplit('/', 1)[-1]
+        if url == urls.USERSTATS:
+            return fake_response(200, json.dumps({'userMetrics': [{'totalActivities': len(self.activities)}]}).encode())
+        if url in (urls.ACT_PROPS, urls.EVT_PROPS):
+            return fake_response(200)
+        if url == urls.LIST:
+            start = params['start']
+            return fake_response(200, json.dumps(self.activities[start:start + params['limit']]).encode())
+        if url.startswith(urls.DEVICE):
+            return fake_response(200, FIXTURES.joinpath('device_856399.json').read_bytes())
+        if url.startswith(urls.GEAR):
+            return fake_response(200, b'[]')
+        if url.startswith(urls.ACTIVITY):
+            return fake_response(200, json.dumps(dict(self.details, activityId=int(activity_id))).encode())
+        if url.startswith(urls.ORIGINAL_ACTIVITY):
+            if activity_id in self.missing_originals:
+                return fake_response(404)
+            if activity_id in self.failing_originals:
+                return fake_response(500)
+            original = io.BytesIO()
+            with zipfile.ZipFile(original, 'w') as zip_file:
+                zip_file.writestr(f"{activity_id}_ACTIVITY.fit", b'FIT')
+            response = fake_response(200, original.getvalue())
+            if activity_id in self.dropped_originals:
+                response.raw = DroppedStream(original.getvalue())
+            return response
+        raise AssertionError(f"unexpected request {method} {url}")
+
+
+def export_with(session, export_dir, template=CSV_TEMPLATE):
+    """Run an export of all activities into export_dir, using session instead of Garmin Connect"""
+    with patch('gcexport.create_session', return_value=session), \
+            patch.object(GarminConnect, 'login', return_value='ticket'):
+        with GarminConnect(export_dir=export_dir) as garmin_connect:
+            export_activities(garmin_connect, export_dir.joinpath('activities.csv'), template)
+
+
+def exported_ids(export_dir):
+    """Return the activity ids in the CSV file of export_dir, in file order"""
+    with open(export_dir.joinpath('activities.csv'), newline='', encoding='utf-8') as csv_file:
+        return [row['Activity ID'] for row in csv.DictReader(csv_file)]
 
 
 class Tests(TestCase):
@@ -21,3 +116,172 @@ class Tests(TestCase):
 
         actual = resolve_path("root", "sub/all", "2018-03-08 12:23:22")
         self.assertEqual("root/sub/all", actual)
+
+    def test_sanitize_filename(self):
+        self.assertEqual("all_ascii", sanitize_filename("all_ascii"))
+        self.assertEqual("a_bc", sanitize_filename("a b/c:"))
+        self.assertEqual("deja_funf", sanitize_filename("déjà fünf"))
+        self.assertEqual("deja_", sanitize_filename("déjà fünf", 5))
+        self.assertEqual("", sanitize_filename(""))
+        self.assertEqual("", sanitize_filename(None))
+
+    def test_offset_date_time(self):
+        self.assertEqual(datetime(2018, 3, 8, 12, 23, 22, 0, FixedOffset(60, "LCL")),
+                         offset_date_time("2018-03-08 12:23:22", "2018-03-08 11:23:22"))
+        self.assertEqual(datetime(2018, 3, 8, 12, 23, 22, 0, FixedOffset(0, "LCL")),
+                         offset_date_time("2018-03-08 12:23:22", "2018-03-08 12:23:22"))
+        self.assertEqual("2018-03-08T12:23:22+01:00",
+                         offset_date_time("2018-03-08 12:23:22", "2018-03-08 11:23:22").isoformat())
+        self.assertEqual("2018-03-08T06:23:22-05:00",
+                         offset_date_time("2018-03-08 06:23:22", "2018-03-08 11:23:22").isoformat())
+        # offsets that are not whole hours, also west of UTC and across the date line
+        self.assertEqual("2018-03-08T16:53:22+05:30",
+                         offset_date_time("2018-03-08 16:53:22", "2018-03-08 11:23:22").isoformat())
+        self.assertEqual("2018-03-07T23:53:22-03:30",
+                         offset_date_time("2018-03-07 23:53:22", "2018-03-08 03:23:22").isoformat())
+
+    def test_extract_login_ticket(self):
+        response = b'<script>\nvar response_url = "https:\\/\\/connect.garmin.com\\/modern\\/?ticket=ST-0123-aB9-cas";\n'
+        self.assertEqual("ST-0123-aB9-cas", extract_login_ticket(response))
+        self.assertIsNone(extract_login_ticket(b'<html>wrong password</html>'))
+
+    def test_from_activities_or_detail(self):
+        act = {'startLatitude': 1.5, 'endLatitude': None}
+        self.assertEqual(2.5, from_activities_or_detail('startLatitude', act, {'startLatitude': 2.5}))
+        self.assertEqual(1.5, from_activities_or_detail('startLatitude', act, {'startLatitude': None}))
+        self.assertEqual(1.5, from_activities_or_detail('startLatitude', act, {}))
+        self.assertIsNone(from_activities_or_detail('endLatitude', act, {}))
+
+    def test_hhmmss_from_seconds(self):
+        # no rounding happens in hhmmss_from_seconds, the caller must round itself
+        self.assertEqual("00:49:29", hhmmss_from_seconds(2969.6))
+        self.assertEqual("00:49:30", hhmmss_from_seconds(round(2969.6)))
+        self.assertEqual("26:00:01", hhmmss_from_seconds(93601))
+        self.assertEqual("100:00:00", hhmmss_from_seconds(360000))
+        self.assertEqual("0.000", hhmmss_from_seconds(None))
+
+    def test_trunc6(self):
+        self.assertEqual("0.123456", trunc6(0.123456789))
+        self.assertEqual("0.123000", trunc6(0.123))
+        self.assertEqual("-8.243479", trunc6(-8.2434781))
+
+    def test_uses_pace(self):
+        self.assertFalse(uses_pace(2, 4))
+        self.assertTrue(uses_pace(1, 4))
+        self.assertTrue(uses_pace(4, 1))
+
+    def test_pace_or_speed_strings(self):
+        # 10 m/s is 36 km/h
+        self.assertEqual(("36.000000", "36.0"), pace_or_speed_strings(uses_pace(2, 4), 10.0))
+        # 3.33 m/s is 12 km/h is 5 min/km
+        self.assertEqual(("5.000000", "05:00"), pace_or_speed_strings(uses_pace(1, 4), 10.0 / 3))
+        self.assertEqual(("5.000000", "05:00"), pace_or_speed_strings(uses_pace(4, 9), 10.0 / 3))
+
+    def test_positive_int(self):
+        self.assertEqual(8, positive_int('8'))
+        for value in ('0', '-2', 'eight'):
+            with self.assertRaises(ArgumentTypeError):
+                positive_int(value)
+
+    def test_settings_round_trip(self):
+        with TemporaryDirectory() as settings_dir:
+            self.assertEqual(0, read_settings(settings_dir)['activity_indices']['gpx'])
+            write_last_activity_index(settings_dir, 42, 'gpx')
+            self.assertEqual(42, read_settings(settings_dir)['activity_indices']['gpx'])
+            self.assertEqual(['.settings'], [path.name for path in Path(settings_dir).iterdir()])
+            # a truncated file (e.g. from a killed run) is ignored
+            settings_file = Path(settings_dir, '.settings')
+            settings_file.write_bytes(settings_file.read_bytes()[:10])
+            self.assertEqual(0, read_settings(settings_dir)['activity_indices']['gpx'])
+
+    def test_session_returns_response_after_retries(self):
+        # the callers check the status of the last response, so exhausted retries must not raise
+        retries = create_session().get_adapter('https://connect.garmin.com').max_retries
+        self.assertIn(503, retries.status_forcelist)
+        self.assertFalse(retries.raise_on_status)
+
+    def test_csv_filter_quoting(self):
+        csv_file = io.StringIO()
+        csv_filter = CsvFilter(csv_file, CSV_TEMPLATE)
+        csv_filter.set_column('id', '123')
+        csv_filter.set_column('activityName', 'Run "fast", then\nslow')
+        csv_filter.set_column('noSuchColumn', 'ignored')
+        csv_filter.write_row()
+        csv_filter.flush()
+
+        self.assertTrue(csv_file.getvalue().startswith('"","","123","Run ""fast"", then\nslow",'))
+        row = next(csv.reader(io.StringIO(csv_file.getvalue())))
+        self.assertEqual(['', '', '123', 'Run "fast", then\nslow'], row[:4])
+        self.assertNotIn('ignored', row)
+
+    def test_rerun_skips_manual_activities(self):
+        # the original download of a manual activity returns 404, so no file marks it as exported
+        with TemporaryDirectory() as tmp:
+            export_dir = Path(tmp)
+            for _ in range(3):
+                session = FakeGarminSession(3, missing_originals=('2',))
+                export_with(session, export_dir)
+            self.assertEqual(['1', '2', '3'], exported_ids(export_dir))
+            self.assertFalse([url for url in session.requested if url.startswith(GarminConnect.urls.ACTIVITY)])
+
+    def test_rerun_completes_aborted_export(self):
+        # the other activities of the chunk may be downloaded although the export is aborted
+        with TemporaryDirectory() as tmp:
+            export_dir = Path(tmp)
+            with self.assertRaises(Exception):
+                export_with(FakeGarminSession(3, failing_originals=('1',)), export_dir)
+            self.assertEqual([], exported_ids(export_dir))
+
+            export_with(FakeGarminSession(3), export_dir)
+            self.assertEqual(['1', '2', '3'], exported_ids(export_dir))
+            self.assertEqual({f"2018-03-0{n}_122322_{n}.{ext}" for n in (1, 2, 3) for ext in ('zip', 'fit')},
+                             {path.name for path in export_dir.glob('2018-*')})
+
+    def test_rerun_into_same_directory(self):
+        with TemporaryDirectory() as tmp:
+            export_dir = Path(tmp)
+            export_with(FakeGarminSession(3), export_dir)
+            self.assertEqual(['1', '2', '3'], exported_ids(export_dir))
+            expected_files = {'.settings', 'activities.csv'} | {f"detail_{n}.json" for n in (1, 2, 3)} | \
+                             {f"2018-03-0{n}_122322_{n}.{ext}" for n in (1, 2, 3) for ext in ('zip', 'fit')}
+            self.assertEqual(expected_files, {path.name for path in export_dir.iterdir()})
+
+            # nothing new: no records appended, no details or files requested
+            session = FakeGarminSession(3)
+            export_with(session, export_dir)
+            self.assertEqual(['1', '2', '3'], exported_ids(export_dir))
+            self.assertEqual(expected_files, {path.name for path in export_dir.iterdir()})
+            self.assertEqual([GarminConnect.urls.USERSTATS, GarminConnect.urls.LIST], session.requested)
+
+            # a new CSV file gets all records again, from the cached details and the existing files
+            export_dir.joinpath('activities.csv').unlink()
+            session = FakeGarminSession(3)
+            export_with(session, export_dir)
+            self.assertEqual(['1', '2', '3'], exported_ids(export_dir))
+            self.assertFalse([url for url in session.requested
+                              if url.startswith((GarminConnect.urls.ACTIVITY, GarminConnect.urls.ORIGINAL_ACTIVITY))])
+
+    def test_rerun_after_dropped_download(self):
+        with TemporaryDirectory() as tmp:
+            export_dir = Path(tmp)
+            with self.assertRaises(requests.ConnectionError):
+                export_with(FakeGarminSession(1, dropped_originals=('1',)), export_dir)
+            self.assertEqual([], [path.name for path in export_dir.glob('2018-*')])
+
+            export_with(FakeGarminSession(1), export_dir)
+            self.assertEqual(['1'], exported_ids(export_dir))
+            self.assertEqual({'2018-03-01_122322_1.zip', '2018-03-01_122322_1.fit'},
+                             {path.name for path in export_dir.glob('2018-*')})
+
+    def test_rerun_with_template_without_id_column(self):
+        template = str(Path(__file__).parent.joinpath('csv_header_moderation.yaml'))
+        with TemporaryDirectory() as tmp:
+            export_dir = Path(tmp)
+            export_with(FakeGarminSession(2, missing_originals=('2',)), export_dir, template)
+            csv_text = export_dir.joinpath('activities.csv').read_text(encoding='utf-8')
+            self.assertEqual(3, len(list(csv.reader(io.StringIO(csv_text)))))
+
+            export_with(FakeGarminSession(3, missing_originals=('2',)), export_dir, template)
+            rows = list(csv.reader(io.StringIO(export_dir.joinpath('activities.csv').read_text(encoding='utf-8'))))
+            self.assertEqual(4, len(rows))
+            self.assertTrue(export_dir.joinpath('activities.csv').read_text(encoding='utf-8').startswith(csv_text))
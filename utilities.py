@@ -6,8 +6,17 @@ from pathlib import Path
 
 import yaml
 
+try:
+    # the LibYAML bindings parse considerably faster than the pure Python loader
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger(__name__)
 
+# characters that are not allowed in the filenames returned by get_valid_filename
+INVALID_FILENAME_RE = re.compile(r'(?u)[^-\w.]')
+
 
 def load_yaml(yamlpath: str):
     """
@@ -18,7 +27,7 @@ def load_yaml(yamlpath: str):
 
     with open(yamlpath_full, 'r', encoding="utf-8") as stream:
         try:
-            outdict = yaml.safe_load(stream)
+            outdict = yaml.load(stream, Loader=SafeLoader)
             return outdict
 
         except yaml.YAMLError as exc:
@@ -40,11 +49,10 @@ def load_properties(multiline, sep='=', comment_char='#', keys=None):
     for line in multiline.splitlines():
         stripped_line = line.strip()
         if stripped_line and not stripped_line.startswith(comment_char):
-            key_value = stripped_line.split(sep)
-            key = key_value[0].strip()
-            value = sep.join(key_value[1:]).strip().strip('"')
-            props[key] = value
-            if keys != None:
+            key, _, value = stripped_line.partition(sep)
+            key = key.strip()
+            props[key] = value.strip().strip('"')
+            if keys is not None:
                 keys.append(key)
     return props
 
@@ -53,12 +61,13 @@ def copy_logfile(logcopy: logging.Logger, dest_dir, case_code: str = None) -> Pa
     """ Copies the log file from logcopy, to output path pth. Will prefix with case_code if given"""
     Path(dest_dir).mkdir(parents=False, exist_ok=True)
 
+    logfile = Path(logcopy.root.handlers[0].baseFilename)
     if case_code is not None:
-        new_logname = f"{case_code}_{Path(logcopy.root.handlers[0].baseFilename).name}"
+        new_logname = f"{case_code}_{logfile.name}"
     else:
-        new_logname = Path(logcopy.root.handlers[0].baseFilename).name
+        new_logname = logfile.name
 
-    copyout = shutil.copy2(logcopy.root.handlers[0].baseFilename, Path(dest_dir, new_logname))
+    copyout = shutil.copy2(logfile, Path(dest_dir, new_logname))
     logcopy.info(f"Copied log file to {copyout}")
     return Path(copyout)
 
@@ -73,4 +82,4 @@ def get_valid_filename(s):
     'johns_portrait_in_2004.jpg'
     """
     s = str(s).strip().replace(' ', '_')
-    return re.sub(r'(?u)[^-\w.]', '', s)
+    return INVALID_FILENAME_RE.sub('', s)